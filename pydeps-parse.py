@@ -49,6 +49,17 @@ future_parser = parser.add_mutually_exclusive_group(required=False)
 future_parser.add_argument('--future', dest='future', action='store_true')
 future_parser.add_argument('--no-future', dest='future', action='store_false')
 parser.set_defaults(feature=False)
+parser.add_argument("--cluster", \
+  help="write the grouped dot file with one cluster per parent group and merged bidirectional edges", \
+  action="store_true", \
+  )
+parser.add_argument("--shard", \
+  help="also write one dot file per SCC or per parent group, plus an overview dot file. Requires --cluster", \
+  type=str, \
+  choices=["scc", "group"], \
+  required=False, \
+  default=None
+  )
 parser.add_argument("-v","--v", \
   help="futurize: docker volume bind", \
   type=str, \
@@ -57,6 +68,8 @@ parser.add_argument("-v","--v", \
   )
 
 args = parser.parse_args()
+if args.shard and not args.cluster:
+    parser.error("--shard requires --cluster")
 
 ## create logger
 logger = logging.getLogger('simple_example')
@@ -501,6 +514,208 @@ def revdepgraph_write_dot(revdep_dict, filename, header):
                 print('    {} -> {}'.format(node, k), file=f)
         print('}', file=f)
 
+def parent_group(node):
+    '''
+    name of the group one level above the node, e.g. `WMCore_A` for
+    `WMCore_A_1`. Nodes without a separator (e.g. the masks) have no parent
+    and an empty string is returned.
+    '''
+    if separator not in node:
+        return ""
+    return node[:node.rindex(separator)]
+
+def revdepgraph_nodes(revdep_dict):
+    nodes = set()
+    for k, v in revdep_dict.items():
+        nodes.add(k)
+        for node in v:
+            nodes.add(node)
+    return nodes
+
+def revdepgraph_edges(revdep_dict, nodes=None):
+    '''
+    Edges of the reversed dependency graph as a sorted list of
+    `(a, b, bidirectional)`, meaning `a -> b`.
+    A pair `a -> b`, `b -> a` is merged into a single edge with
+    `bidirectional=True`. If `nodes` is given, only the edges with both ends
+    in `nodes` are kept.
+    '''
+    edges = set()
+    for k, v in revdep_dict.items():
+        for node in v:
+            if nodes is not None and (node not in nodes or k not in nodes):
+                continue
+            edges.add((node, k))
+    return merge_edges(edges)
+
+def merge_edges(edges):
+    '''
+    Sort a set of edges `(a, b)` and merge each pair `a -> b`, `b -> a`
+    into a single `(a, b, True)`.
+    '''
+    merged = []
+    for a, b in sorted(edges):
+        if (b, a) in edges and a != b:
+            if a < b:
+                merged.append((a, b, True))
+        else:
+            merged.append((a, b, False))
+    return merged
+
+def strongly_connected_components(revdep_dict):
+    '''
+    Tarjan's algorithm, iterative so that it does not hit the recursion limit
+    on huge graphs. Returns a list of sets of nodes.
+    '''
+    successors = {node: set() for node in revdepgraph_nodes(revdep_dict)}
+    for k, v in revdep_dict.items():
+        for node in v:
+            successors[node].add(k)
+    index = {}
+    lowlink = {}
+    stack = []
+    onstack = set()
+    sccs = []
+    for root in sorted(successors):
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        onstack.add(root)
+        work = [(root, iter(sorted(successors[root])))]
+        while work:
+            node, children = work[-1]
+            descended = False
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    onstack.add(child)
+                    work.append((child, iter(sorted(successors[child]))))
+                    descended = True
+                    break
+                elif child in onstack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            if descended:
+                continue
+            work.pop()
+            if work:
+                lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+            if lowlink[node] == index[node]:
+                scc = set()
+                while True:
+                    member = stack.pop()
+                    onstack.discard(member)
+                    scc.add(member)
+                    if member == node:
+                        break
+                sccs.append(scc)
+    return sccs
+
+def print_edges(edges, f):
+    for a, b, bidirectional in edges:
+        if bidirectional:
+            print('    {} -> {} [dir=both]'.format(a, b), file=f)
+        else:
+            print('    {} -> {}'.format(a, b), file=f)
+
+def revdepgraph_write_dot_cluster(revdep_dict, filename, header, nodes=None, edges=None):
+    '''
+    Write simplified reversed dependency graph to dot file, with one
+    `subgraph cluster_*` per parent group (see example/example_cluster.dot)
+    and bidirectional dependencies merged into a single `dir=both` edge.
+    If `nodes` is given, only the subgraph induced by `nodes` is written.
+    If `edges` is given, it is the set of `(a, b)` edges to write, and
+    `revdep_dict` is not scanned for them.
+    '''
+    if nodes is None:
+        nodes = revdepgraph_nodes(revdep_dict)
+    groups = {}
+    for node in nodes:
+        groups.setdefault(parent_group(node), []).append(node)
+    with open(filename, "w+") as f:
+        f.write('\n'.join(header))
+        print('\n', file=f)
+        # nodes
+        for idx, group in enumerate(sorted(groups)):
+            if group == "":
+                continue
+            print('    subgraph cluster_{} {{'.format(idx), file=f)
+            print('      label="{}"'.format(group), file=f)
+            for node in sorted(groups[group]):
+                print('      {} [label="{}"]'.format(node, node), file=f)
+            print('    }', file=f)
+        for node in sorted(groups.get("", [])):
+            print('    {} [label="{}"]'.format(node, node), file=f)
+        # rules
+        if edges is None:
+            print_edges(revdepgraph_edges(revdep_dict, nodes), f)
+        else:
+            print_edges(merge_edges(edges), f)
+        print('}', file=f)
+
+def revdepgraph_write_dot_shards(revdep_dict, basename, header, mode):
+    '''
+    Split the clustered dot output into pieces that graphviz can lay out
+    quickly:
+    * mode "scc": one dot file per strongly connected component with more
+      than one node
+    * mode "group": one dot file per parent group
+    plus `basename + "_overview.dot"`, with one node per shard and the edges
+    between shards. With mode "scc" this is the condensation DAG.
+    Single-node components and nodes without a parent group (e.g. the masks)
+    do not get their own file and are kept as plain nodes in the overview.
+    Shards are quoted in the overview with a name that contains a space, so
+    they can not collide with a module name.
+    '''
+    if mode == "scc":
+        components = sorted(strongly_connected_components(revdep_dict),
+                            key=lambda scc: min(scc))
+        singles = [min(scc) for scc in components if len(scc) == 1]
+        shards = [scc for scc in components if len(scc) > 1]
+        names = ["scc{}".format(idx) for idx in range(len(shards))]
+    else:
+        groups = {}
+        singles = []
+        for node in revdepgraph_nodes(revdep_dict):
+            group = parent_group(node)
+            if group == "":
+                singles.append(node)
+            else:
+                groups.setdefault(group, set()).add(node)
+        names = sorted(groups)
+        shards = [groups[name] for name in names]
+    ids = ['"shard {}"'.format(name) for name in names]
+    shard_of = {node: node for node in singles}
+    for shard_id, shard in zip(ids, shards):
+        for node in shard:
+            shard_of[node] = shard_id
+    # split the edges between the shards and the overview in a single pass
+    shard_edges = {shard_id: set() for shard_id in ids}
+    overview = set()
+    for k, v in revdep_dict.items():
+        for node in v:
+            if shard_of[node] == shard_of[k]:
+                if shard_of[k] in shard_edges:
+                    shard_edges[shard_of[k]].add((node, k))
+            else:
+                overview.add((shard_of[node], shard_of[k]))
+    for name, shard_id, shard in zip(names, ids, shards):
+        revdepgraph_write_dot_cluster(
+            revdep_dict, "{}_{}.dot".format(basename, name), header,
+            shard, shard_edges[shard_id])
+        logger.debug("shard %s: nodes %s" % (name, len(shard)))
+    with open(basename + "_overview.dot", "w+") as f:
+        f.write('\n'.join(header))
+        print('\n', file=f)
+        for name, shard_id, shard in zip(names, ids, shards):
+            print('    {} [label="{} ({} nodes)"]'.format(shard_id, name, len(shard)), file=f)
+        for node in sorted(singles):
+            print('    {} [label="{}"]'.format(node, node), file=f)
+        print_edges(merge_edges(overview), f)
+        print('}', file=f)
+    logger.info("meta: shards %s" % len(names))
+
 def depgraph_write_json(revdep_dict, filename):
     dep_dict = {}
     for k1 in revdep_dict:
@@ -534,11 +749,25 @@ def main():
         rules_rev_group,
         args.input_dotfile[:-4] + "_group_l" + str(args.level) + ".txt", 
         )
-    revdepgraph_write_dot(
-        rules_rev_group,
-        args.input_dotfile[:-4] + "_group_l" + str(args.level) + ".dot",
-        header
-        )
+    if args.cluster:
+        revdepgraph_write_dot_cluster(
+            rules_rev_group,
+            args.input_dotfile[:-4] + "_group_l" + str(args.level) + ".dot",
+            header
+            )
+        if args.shard:
+            revdepgraph_write_dot_shards(
+                rules_rev_group,
+                args.input_dotfile[:-4] + "_group_l" + str(args.level) + "_" + args.shard,
+                header,
+                args.shard
+                )
+    else:
+        revdepgraph_write_dot(
+            rules_rev_group,
+            args.input_dotfile[:-4] + "_group_l" + str(args.level) + ".dot",
+            header
+            )
     depgraph_write_json(
         rules_rev_group,
         args.input_dotfile[:-4] + "_direct_group_l" + str(args.level) + ".txt", 